@@ -14,17 +14,85 @@ Environment variables required:
 """
 
 import asyncio
+import functools
+import hashlib
+import json
+import logging
 import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 import httpx
+import sqlglot
 import yaml
 from dotenv import load_dotenv
-from nicegui import ui, run, background_tasks
+from nicegui import app, ui, run, background_tasks
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Semantic cache is optional: uv sync --extra semantic
+    SentenceTransformer = None
 
 load_dotenv()
 
 BERDL_API_URL = "https://hub.berdl.kbase.us/apis/mcp/delta/tables/query"
+BERDL_HEALTH_URL = "https://hub.berdl.kbase.us/apis/mcp/health"
+HEALTH_CACHE_SECONDS = 30
+RESULT_LIMIT = 100  # Rows fetched for display
+EXPLAIN_ROWS = 10  # Rows sent to Claude for the explanation
 SKILLS_PATH = Path(__file__).parent / ".claude" / "skills" / "lakehouse-skills" / "kbase-lakehouse-analysis"
+CLAUDE_MODEL = "sonnet"
+EXAMPLE_QUESTIONS = [
+    "How many samples have plastic degradation?",
+    "What kingdoms are in the taxonomy?",
+    "Show samples with methanogenesis",
+    "Count studies by ecosystem type",
+]
+
+# Credentials are read once at startup (see the warning before ui.run)
+_KB_TOKEN = os.getenv("KB_AUTH_TOKEN")
+_ANTHROPIC_KEY = os.getenv("ANTHROPIC_API_KEY")
+_AUTH_HEADER = {"Authorization": f"Bearer {_KB_TOKEN}"} if _KB_TOKEN else {}
+
+# Shared HTTP/2 client so BERDL queries reuse one keep-alive connection
+_HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=30.0,
+    headers={"Content-Type": "application/json", **_AUTH_HEADER},
+    limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=15.0),
+)
+app.on_shutdown(_HTTP.aclose)
+
+# In-memory LRU caches for Claude responses (set LLM_CACHE_ENABLED=0 to disable),
+# backed by SQLite so they survive restarts (set LLM_CACHE_PATH="" for memory only)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_SIZE = 512
+LLM_CACHE_DISK_SIZE = 5000
+LLM_CACHE_PRUNE_EVERY = 50  # Disk writes between LFU pruning passes
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(Path(__file__).parent / "berdl_cache.sqlite"))
+_llm_caches: dict[str, OrderedDict[str, str]] = {"sql": OrderedDict(), "explain": OrderedDict()}
+
+# Claude calls currently running, so identical concurrent prompts share one call
+_inflight: dict[str, asyncio.Future] = {}
+
+# Semantic cache: reuse SQL for paraphrased standalone questions
+SEMANTIC_CACHE_ENABLED = LLM_CACHE_ENABLED and SentenceTransformer is not None
+SEMANTIC_CACHE_THRESHOLD = 0.87
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")  # INT8-quantized export
+_embedder = None
+_embedder_lock = threading.Lock()
+_q_vecs = None  # (capacity, 384) float32 buffer; rows [:_q_count] are L2-normalized embeddings
+_q_count = 0
+_q_sql: list[str] = []
+_q_keys: list[str | None] = []  # semantic_cache row keys
+_q_last_used: list[int] = []
+_q_clock = 0
 
 
 def load_schema_context() -> str:
@@ -90,27 +158,54 @@ def load_schema_context() -> str:
 # Load schema context at startup
 SCHEMA_CONTEXT = load_schema_context()
 
+# Statements that modify data or permissions; matched as whole words only when
+# sqlglot can't parse the query or only recognizes it as a raw command
+_BANNED_SQL = re.compile(r"\b(DROP|DELETE|UPDATE|INSERT|ALTER|TRUNCATE|GRANT|REVOKE|MERGE)\b", re.IGNORECASE)
+
+# Only statements starting with one of these keywords are considered at all
+_READ_ONLY_KEYWORD = re.compile(r"^[\s(]*(SELECT|WITH|SHOW|DESCRIBE|EXPLAIN)\b", re.IGNORECASE)
+
+# Read-only statements sqlglot's Spark dialect parses as an opaque exp.Command
+_READ_ONLY_COMMANDS = {"SHOW", "EXPLAIN"}
+
+# sqlglot warns on every SHOW/EXPLAIN that it falls back to parsing them as a command
+logging.getLogger("sqlglot").setLevel(logging.ERROR)
 
-def query_berdl(sql: str) -> dict:
+
+def is_read_only_sql(sql: str) -> bool:
+    """Check that sql is a single SELECT, DESCRIBE, SHOW or EXPLAIN statement."""
+    if not _READ_ONLY_KEYWORD.match(sql):
+        return False
+
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="spark") if s is not None]
+    except sqlglot.errors.SqlglotError:
+        # Let BERDL decide on read-only syntax sqlglot doesn't know, but still
+        # require a single statement and block writes
+        return ";" not in sql.strip().rstrip(";") and not _BANNED_SQL.search(sql)
+
+    if len(statements) != 1:
+        return False
+
+    statement = statements[0]
+    if isinstance(statement, sqlglot.exp.Command):
+        return str(statement.this).upper() in _READ_ONLY_COMMANDS and not _BANNED_SQL.search(sql)
+
+    return isinstance(statement, (sqlglot.exp.Query, sqlglot.exp.Describe))
+
+
+async def query_berdl(sql: str) -> dict:
     """Execute SQL query against BERDL and return results."""
-    token = os.getenv("KB_AUTH_TOKEN")
-    if not token:
+    if not _KB_TOKEN:
         return {"error": "KB_AUTH_TOKEN not set in .env"}
 
-    # Basic SQL injection prevention
-    if any(keyword in sql.upper() for keyword in ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER"]):
+    if not is_read_only_sql(sql):
         return {"error": "Only SELECT queries are allowed"}
 
     try:
-        response = httpx.post(
-            BERDL_API_URL,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json={"query": sql, "limit": 100},
-            timeout=30.0,
-        )
+        response = await _HTTP.post(BERDL_API_URL, json={"query": sql, "limit": RESULT_LIMIT})
+        if response.status_code in (401, 403):
+            _mark_token_rejected()
         data = response.json()
 
         # Check for API errors
@@ -124,30 +219,145 @@ def query_berdl(sql: str) -> dict:
         return {"error": str(e)}
 
 
-def _run_claude_cli(prompt: str) -> str:
-    """Run Claude CLI synchronously (called from thread pool)."""
-    import subprocess
-    import re
+_last_status: tuple[float, bool, str] = (0.0, False, "")
+_token_valid: bool | None = None  # Checked once per process, then updated by query_berdl
+
+
+def _mark_token_rejected():
+    """Record that BERDL rejected KB_AUTH_TOKEN so the status indicator shows it."""
+    global _token_valid, _last_status
+    _token_valid = False
+    _last_status = (0.0, False, "")
+
+
+# Overall statuses that mean BERDL can't serve queries; api_reference.md only names the
+# DeepHealthResponse type, so any other status on a 2xx response counts as healthy
+_UNHEALTHY_STATUSES = {"unhealthy", "degraded", "down", "error", "fail", "failed"}
+
+
+def _parse_health(response: httpx.Response) -> tuple[bool, str]:
+    """Treat a 2xx health response as connected unless its body reports a bad status."""
+    if not response.is_success:
+        return False, f"Health check returned HTTP {response.status_code}"
+
+    try:
+        body = response.json()
+    except ValueError:
+        return True, ""
+    status = body.get("status") if isinstance(body, dict) else None
+    if isinstance(status, str) and status.lower() in _UNHEALTHY_STATUSES:
+        return False, f"BERDL is {status}"
+    return True, ""
+
+
+async def check_berdl_health() -> tuple[bool, str]:
+    """Probe the BERDL health endpoint, reusing the last result for a short while."""
+    global _last_status, _token_valid
+    checked_at, ok, message = _last_status
+    if checked_at and time.monotonic() - checked_at < HEALTH_CACHE_SECONDS:
+        return ok, message
+
+    if not _KB_TOKEN:
+        ok, message = False, "KB_AUTH_TOKEN not set in .env"
+    elif _token_valid is False:
+        ok, message = False, "KB_AUTH_TOKEN was rejected by BERDL"
+    else:
+        try:
+            response = await _HTTP.get(BERDL_HEALTH_URL, timeout=3.0)
+            ok, message = _parse_health(response)
+
+            # /health doesn't check credentials, so confirm the token once with a tiny query
+            if ok and _token_valid is None:
+                response = await _HTTP.post(BERDL_API_URL, json={"query": "SELECT 1", "limit": 1}, timeout=10.0)
+                _token_valid = response.status_code not in (401, 403)
+                if not _token_valid:
+                    ok, message = False, "KB_AUTH_TOKEN was rejected by BERDL"
+        except httpx.TimeoutException:
+            ok, message = False, "Health check timed out"
+        except Exception as e:
+            ok, message = False, str(e)
+
+    _last_status = (time.monotonic(), ok, message)
+    return ok, message
 
+
+def _build_claude_env() -> dict:
+    """Build the Claude CLI environment, passing OAuth tokens the way the CLI expects."""
     env = os.environ.copy()
-    oauth_token = os.getenv("ANTHROPIC_API_KEY", "")
-    if oauth_token.startswith("sk-ant-oat"):
-        env["CLAUDE_CODE_OAUTH_TOKEN"] = oauth_token
+    if _ANTHROPIC_KEY and _ANTHROPIC_KEY.startswith("sk-ant-oat"):
+        env["CLAUDE_CODE_OAUTH_TOKEN"] = _ANTHROPIC_KEY
         env.pop("ANTHROPIC_API_KEY", None)
+    return env
+
+
+# Resolve the Claude CLI and its environment once instead of on every call
+_CLAUDE_ENV = _build_claude_env()
+_CLAUDE_BIN = shutil.which("claude")
+_CLAUDE_TEXT_ARGS = ("-p", "--output-format", "text", "--model", CLAUDE_MODEL)
+_CLAUDE_STREAM_ARGS = (
+    "-p", "--output-format", "stream-json", "--verbose", "--include-partial-messages", "--model", CLAUDE_MODEL,
+)
+
+
+async def _read_stream_json(proc, on_text) -> tuple[str, bytes]:
+    """Forward text deltas from Claude CLI stream-json output; return the final text and stderr."""
+    text = ""
+    result = None
+    async for line in proc.stdout:
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+        if event.get("type") == "stream_event":
+            delta = event.get("event", {}).get("delta", {})
+            if delta.get("type") == "text_delta":
+                text += delta.get("text", "")
+                on_text(text)
+        elif event.get("type") == "result":
+            result = event.get("result")
+
+    _, stderr = await proc.communicate()
+    return (result if result is not None else text), stderr
+
+
+async def _run_claude_cli(prompt: str, system: str = None, on_text=None) -> str:
+    """Run Claude CLI as an asyncio subprocess, optionally streaming text to on_text."""
+    if _CLAUDE_BIN is None:
+        return "-- Error: Claude CLI not found"
+
+    args = _CLAUDE_STREAM_ARGS if on_text else _CLAUDE_TEXT_ARGS
+
+    # Static context goes in the system prompt so it forms a stable, cacheable prefix
+    if system:
+        args += ("--append-system-prompt", system)
 
     try:
-        result = subprocess.run(
-            ["claude", "-p", "--output-format", "text", "--model", "sonnet", "--", prompt],
-            capture_output=True,
-            text=True,
-            timeout=60,
-            env=env,
+        proc = await asyncio.create_subprocess_exec(
+            _CLAUDE_BIN, *args, "--", prompt,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=_CLAUDE_ENV,
+            limit=2**20,  # stream-json lines can exceed the default 64KB
         )
+        try:
+            if on_text:
+                output, stderr = await asyncio.wait_for(_read_stream_json(proc, on_text), timeout=60)
+            else:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=60)
+                output = stdout.decode()
+        except asyncio.TimeoutError:
+            return "-- Error: Claude CLI timed out"
+        finally:
+            # Reap the CLI on timeout, cancellation or an on_text error too
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
 
-        if result.returncode != 0:
-            return f"-- Error: Claude CLI failed: {result.stderr[:200]}"
+        if proc.returncode != 0:
+            return f"-- Error: Claude CLI failed: {stderr.decode()[:200]}"
 
-        output = result.stdout.strip()
+        output = output.strip()
 
         # Extract SQL from markdown code blocks if present
         sql_match = re.search(r'```(?:sql)?\s*([\s\S]*?)```', output)
@@ -160,16 +370,346 @@ def _run_claude_cli(prompt: str) -> str:
 
         # Otherwise return as-is (might be an explanation for explain_results)
         return output
-    except subprocess.TimeoutExpired:
-        return "-- Error: Claude CLI timed out"
     except FileNotFoundError:
         return "-- Error: Claude CLI not found"
     except Exception as e:
         return f"-- Error: {e}"
 
 
-async def generate_sql(user_question: str, conversation_history: list = None, previous_sql: str = None, error: str = None) -> str:
-    """Use Claude CLI to generate SQL from natural language question."""
+@functools.lru_cache(maxsize=8)
+def _system_digest(system: str) -> str:
+    """Hash a system prompt once; in practice this is only SCHEMA_CONTEXT."""
+    return hashlib.sha256(system.encode()).hexdigest()
+
+
+def _cache_key(prompt: str, system: str = None) -> str:
+    """Hash the model and prompts into a stable cache key."""
+    system_digest = _system_digest(system) if system else None
+    payload = json.dumps({"model": CLAUDE_MODEL, "system": system_digest, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_put(cache_name: str, key: str, output: str):
+    """Add a response to an in-memory cache and persist it."""
+    cache = _llm_caches[cache_name]
+    cache[key] = output
+    cache.move_to_end(key)
+    if len(cache) > LLM_CACHE_SIZE:
+        cache.popitem(last=False)
+    _db_store(cache_name, key, output)
+
+
+async def _cached_claude(cache_name: str, prompt: str, system: str = None, on_text=None, store: bool = True) -> str:
+    """Run Claude CLI, reusing the previous or in-flight response for an identical prompt.
+
+    With store=False the response is only looked up, and the caller caches it once it is known to be good.
+    """
+    cache = _llm_caches[cache_name]
+    key = _cache_key(prompt, system)
+    if LLM_CACHE_ENABLED and key in cache:
+        cache.move_to_end(key)
+        _record_hit(cache_name, key)
+        return cache[key]
+
+    while key in _inflight:
+        shared = _inflight[key]
+        try:
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            # If the caller running the shared call was cancelled rather than us,
+            # join the next in-flight call or run our own
+            if not shared.cancelled() or asyncio.current_task().cancelling():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        output = await _run_claude_cli(prompt, system, on_text)
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        del _inflight[key]
+    future.set_result(output)
+
+    if store and LLM_CACHE_ENABLED and not output.startswith("-- Error"):  # Don't cache failures
+        _cache_put(cache_name, key, output)
+    return output
+
+
+def _load_embedder():
+    """Load MiniLM on ONNX Runtime with INT8 weights, falling back to PyTorch; None if neither loads."""
+    try:
+        return SentenceTransformer(EMBEDDING_MODEL, backend="onnx", model_kwargs={"file_name": EMBEDDING_ONNX_FILE})
+    except Exception as onnx_error:  # onnxruntime not installed or file unavailable
+        try:
+            model = SentenceTransformer(EMBEDDING_MODEL)
+        except Exception as e:
+            print(f"Warning: embedding model unavailable (ONNX: {onnx_error}; PyTorch: {e})")
+            return None
+        print(f"Warning: ONNX embedding model unavailable, using PyTorch ({onnx_error})")
+        return model
+
+
+def _get_embedder():
+    """Load the embedder once, even when several threads ask for it concurrently."""
+    global _embedder, SEMANTIC_CACHE_ENABLED
+    if _embedder is not None:
+        return _embedder
+
+    with _embedder_lock:
+        if _embedder is None and SEMANTIC_CACHE_ENABLED:
+            _embedder = _load_embedder()
+            if _embedder is None:
+                SEMANTIC_CACHE_ENABLED = False
+    return _embedder
+
+
+@functools.lru_cache(maxsize=64)  # remember_sql re-embeds the question generate_sql just looked up
+def _embed_question(question: str):
+    """Embed a question with MiniLM (called from thread pool); None if the model is unavailable."""
+    global SEMANTIC_CACHE_ENABLED
+    try:
+        embedder = _get_embedder()
+        if embedder is None:
+            return None
+        return embedder.encode([question], normalize_embeddings=True)[0].astype(np.float32)
+    except Exception as e:  # e.g. offline and the model isn't downloaded yet
+        # The semantic cache is optional: turn it off and keep using the exact-match cache
+        if SEMANTIC_CACHE_ENABLED:
+            SEMANTIC_CACHE_ENABLED = False
+            print(f"Warning: semantic cache disabled, embedding model unavailable ({e})")
+        return None
+
+
+def _semantic_match(vec) -> int | None:
+    """Return the slot of the most similar previous question, if close enough."""
+    if not _q_count:
+        return None
+
+    sims = _q_vecs[:_q_count] @ vec
+    best = int(sims.argmax())
+    return best if sims[best] >= SEMANTIC_CACHE_THRESHOLD else None
+
+
+def _semantic_lookup(vec) -> str | None:
+    """Return cached SQL for the most similar previous question, if close enough."""
+    global _q_clock
+    best = _semantic_match(vec)
+    if best is None:
+        return None
+
+    _q_clock += 1
+    _q_last_used[best] = _q_clock
+    if _q_keys[best] is not None:
+        _record_hit("semantic", _q_keys[best])
+    return _q_sql[best]
+
+
+def _semantic_store(vec, sql: str, key: str = None):
+    """Add a question embedding and its SQL, evicting the least recently used entry."""
+    global _q_vecs, _q_count, _q_clock
+    _q_clock += 1
+
+    if _q_count >= LLM_CACHE_SIZE:
+        # Full: overwrite the least recently used slot in place
+        slot = _q_last_used.index(min(_q_last_used))
+        _q_vecs[slot] = vec
+        _q_sql[slot] = sql
+        _q_keys[slot] = key
+        _q_last_used[slot] = _q_clock
+        return
+
+    if _q_vecs is None or _q_count == len(_q_vecs):
+        # Grow by doubling so appends stay amortized O(1)
+        grown = np.empty((min(max(16, 2 * _q_count), LLM_CACHE_SIZE), len(vec)), dtype=np.float32)
+        if _q_count:
+            grown[:_q_count] = _q_vecs[:_q_count]
+        _q_vecs = grown
+
+    _q_vecs[_q_count] = vec
+    _q_count += 1
+    _q_sql.append(sql)
+    _q_keys.append(key)
+    _q_last_used.append(_q_clock)
+
+
+def _semantic_forget(sql: str):
+    """Remove every question that maps to sql."""
+    global _q_count
+    slot = 0
+    while slot < _q_count:
+        if _q_sql[slot] != sql:
+            slot += 1
+            continue
+        # Move the last entry into the freed slot so the buffer stays contiguous
+        last = _q_count - 1
+        _q_vecs[slot] = _q_vecs[last]
+        _q_sql[slot] = _q_sql[last]
+        _q_keys[slot] = _q_keys[last]
+        _q_last_used[slot] = _q_last_used[last]
+        del _q_sql[last], _q_keys[last], _q_last_used[last]
+        _q_count = last
+
+
+_CACHE_DB_VERSION = 3  # 3: SQL rows are only written once BERDL has run them
+_db_lock = threading.Lock()  # Writes run in the thread pool
+_db_writes = 0
+_pending_hits: dict[tuple[str, str], int] = {}  # (cache name, key) -> hits not yet written
+
+
+def _cache_meta(cache_name: str) -> str:
+    """Describe what a cache's entries depend on, so stale rows are skipped on load."""
+    if cache_name == "explain":
+        return CLAUDE_MODEL
+    meta = f"{CLAUDE_MODEL}:{_system_digest(SCHEMA_CONTEXT)}"
+    if cache_name == "semantic":
+        meta += f":{EMBEDDING_MODEL}:{EMBEDDING_ONNX_FILE}"
+    return meta
+
+
+def _open_cache_db():
+    """Open the on-disk cache database, creating its tables if needed."""
+    conn = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != _CACHE_DB_VERSION:
+        # Cached responses are disposable, so rebuild rather than migrate old layouts
+        conn.executescript(f"""
+            DROP TABLE IF EXISTS llm_cache;
+            DROP TABLE IF EXISTS semantic_cache;
+            PRAGMA user_version = {_CACHE_DB_VERSION};
+        """)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache TEXT, key TEXT, meta TEXT, output TEXT, hits INTEGER DEFAULT 0, ts REAL,
+            PRIMARY KEY (cache, key)
+        );
+        CREATE TABLE IF NOT EXISTS semantic_cache (
+            key TEXT PRIMARY KEY, meta TEXT, embedding BLOB, sql TEXT, hits INTEGER DEFAULT 0, ts REAL
+        );
+    """)
+    return conn
+
+
+def _flush_hits():
+    """Add pending hit counts to their rows (caller holds _db_lock inside a transaction)."""
+    global _pending_hits
+    hits, _pending_hits = _pending_hits, {}  # Counts are approximate; a racing hit may be dropped
+    now = time.time()
+    _cache_db.executemany(
+        "UPDATE semantic_cache SET hits = hits + ?, ts = ? WHERE key = ?",
+        [(n, now, key) for (name, key), n in hits.items() if name == "semantic"],
+    )
+    _cache_db.executemany(
+        "UPDATE llm_cache SET hits = hits + ?, ts = ? WHERE cache = ? AND key = ?",
+        [(n, now, name, key) for (name, key), n in hits.items() if name != "semantic"],
+    )
+
+
+def _prune_cache_db():
+    """Evict the least frequently used rows past LLM_CACHE_DISK_SIZE (caller holds _db_lock)."""
+    for cache_name in _llm_caches:
+        _cache_db.execute(
+            """DELETE FROM llm_cache WHERE cache = ? AND key IN (
+                SELECT key FROM llm_cache WHERE cache = ? ORDER BY hits DESC, ts DESC LIMIT -1 OFFSET ?)""",
+            (cache_name, cache_name, LLM_CACHE_DISK_SIZE),
+        )
+    _cache_db.execute(
+        """DELETE FROM semantic_cache WHERE key IN (
+            SELECT key FROM semantic_cache ORDER BY hits DESC, ts DESC LIMIT -1 OFFSET ?)""",
+        (LLM_CACHE_DISK_SIZE,),
+    )
+
+
+def _db_write(statement: str = None, params: tuple = ()):
+    """Write one row plus pending hit counts in a single transaction (called from thread pool).
+
+    Cache persistence is best-effort, so SQLite errors are ignored.
+    """
+    global _db_writes
+    try:
+        with _db_lock, _cache_db:
+            if statement:
+                _cache_db.execute(statement, params)
+                _db_writes += 1
+                if _db_writes % LLM_CACHE_PRUNE_EVERY == 0:
+                    _prune_cache_db()
+            _flush_hits()  # After the insert, so hits on a just-stored row aren't lost
+    except sqlite3.Error:
+        pass
+
+
+def _persist(statement: str = None, params: tuple = ()):
+    """Schedule a cache database write off the event loop."""
+    if _cache_db is not None:
+        background_tasks.create(run.io_bound(_db_write, statement, params))
+
+
+def _record_hit(cache_name: str, key: str):
+    """Count a cache hit in memory; counts are written with the next cache write."""
+    if _cache_db is None:
+        return
+    _pending_hits[(cache_name, key)] = _pending_hits.get((cache_name, key), 0) + 1
+    if len(_pending_hits) >= LLM_CACHE_PRUNE_EVERY:
+        _persist()
+
+
+def _db_store(cache_name: str, key: str, output: str):
+    """Persist a Claude response."""
+    _persist(
+        "INSERT OR REPLACE INTO llm_cache (cache, key, meta, output, hits, ts) VALUES (?, ?, ?, ?, 0, ?)",
+        (cache_name, key, _cache_meta(cache_name), output, time.time()),
+    )
+
+
+def _db_store_semantic(key: str, vec, sql: str):
+    """Persist a question embedding and its SQL."""
+    _persist(
+        "INSERT OR REPLACE INTO semantic_cache (key, meta, embedding, sql, hits, ts) VALUES (?, ?, ?, ?, 0, ?)",
+        (key, _cache_meta("semantic"), vec.astype(np.float32).tobytes(), sql, time.time()),
+    )
+
+
+def _db_forget_sql(key: str, sql: str):
+    """Delete SQL that failed on BERDL, both as the exact answer and for any paraphrase."""
+    _persist("DELETE FROM llm_cache WHERE cache = 'sql' AND key = ? AND output = ?", (key, sql))
+    _persist("DELETE FROM semantic_cache WHERE sql = ?", (sql,))
+
+
+def _load_cache_db():
+    """Warm the in-memory caches with the most recently used entries on disk."""
+    for cache_name, cache in _llm_caches.items():
+        rows = _cache_db.execute(
+            "SELECT key, output FROM llm_cache WHERE cache = ? AND meta = ? ORDER BY ts DESC LIMIT ?",
+            (cache_name, _cache_meta(cache_name), LLM_CACHE_SIZE),
+        ).fetchall()
+        for key, output in reversed(rows):  # Oldest first so LRU order is preserved
+            cache[key] = output
+
+    if SEMANTIC_CACHE_ENABLED:
+        rows = _cache_db.execute(
+            "SELECT key, embedding, sql FROM semantic_cache WHERE meta = ? ORDER BY ts DESC LIMIT ?",
+            (_cache_meta("semantic"), LLM_CACHE_SIZE),
+        ).fetchall()
+        for key, embedding, sql in reversed(rows):
+            _semantic_store(np.frombuffer(embedding, dtype=np.float32), sql, key)
+
+
+_cache_db = None
+if LLM_CACHE_ENABLED and LLM_CACHE_PATH:
+    try:
+        _cache_db = _open_cache_db()
+        _load_cache_db()
+    except sqlite3.Error as e:
+        print(f"Warning: persistent LLM cache disabled ({e})")
+        _cache_db = None
+    else:
+        app.on_shutdown(lambda: _db_write())  # Flush pending hit counts
+
+
+def _sql_prompt(user_question: str, conversation_history: list = None, previous_sql: str = None, error: str = None) -> str:
+    """Build the Claude prompt for a question, or for fixing SQL that failed."""
     history_context = ""
     if conversation_history:
         history_parts = []
@@ -178,12 +718,10 @@ async def generate_sql(user_question: str, conversation_history: list = None, pr
             history_parts.append(f"SQL: {entry['sql']}")
             if entry.get('result_summary'):
                 history_parts.append(f"Result: {entry['result_summary']}")
-        history_context = "\n\nPrevious conversation:\n" + "\n".join(history_parts)
+        history_context = "Previous conversation:\n" + "\n".join(history_parts) + "\n\n"
 
     if previous_sql and error:
-        prompt = f"""{SCHEMA_CONTEXT}{history_context}
-
-The user asked: {user_question}
+        return f"""{history_context}The user asked: {user_question}
 
 I tried this SQL but it failed:
 {previous_sql}
@@ -191,42 +729,147 @@ I tried this SQL but it failed:
 Error: {error}
 
 Fix the SQL query. Return ONLY the raw SQL, no explanation, no markdown code blocks."""
-    else:
-        prompt = f"""{SCHEMA_CONTEXT}{history_context}
 
-Write a SQL query to answer: {user_question}
+    return f"""{history_context}Write a SQL query to answer: {user_question}
 
 Return ONLY the raw SQL query, no explanation, no markdown code blocks, no backticks."""
 
-    return await run.io_bound(_run_claude_cli, prompt)
 
+async def generate_sql(user_question: str, conversation_history: list = None, previous_sql: str = None, error: str = None) -> str:
+    """Use Claude CLI to generate SQL from natural language question."""
+    prompt = _sql_prompt(user_question, conversation_history, previous_sql, error)
+
+    # Paraphrase matching only applies to standalone questions; follow-ups and
+    # fixes depend on the conversation, so they go through the exact cache only
+    vec = None
+    if SEMANTIC_CACHE_ENABLED and not conversation_history and not previous_sql:
+        vec = await run.io_bound(_embed_question, user_question)
+        cached = _semantic_lookup(vec) if vec is not None else None
+        if cached is not None:
+            return cached
+
+    # SQL is only cached by remember_sql once BERDL has run it successfully
+    return await _cached_claude("sql", prompt, system=SCHEMA_CONTEXT, store=False)
+
+
+async def remember_sql(user_question: str, conversation_history: list, sql: str):
+    """Cache SQL that BERDL ran successfully as the answer to the question's first prompt.
+
+    A question whose first SQL needed fixing then gets the working SQL straight away next time.
+    """
+    if not LLM_CACHE_ENABLED:
+        return
+    _cache_put("sql", _cache_key(_sql_prompt(user_question, conversation_history), SCHEMA_CONTEXT), sql)
+
+    # Standalone questions also answer their paraphrases
+    if SEMANTIC_CACHE_ENABLED and not conversation_history:
+        vec = await run.io_bound(_embed_question, user_question)
+        slot = _semantic_match(vec) if vec is not None else None
+        if vec is not None and (slot is None or _q_sql[slot] != sql):
+            key = _cache_key(user_question, SCHEMA_CONTEXT)
+            _semantic_store(vec, sql, key)
+            _db_store_semantic(key, vec, sql)
+
+
+def forget_sql(user_question: str, conversation_history: list, sql: str):
+    """Drop SQL that failed on BERDL if it is the cached answer to the question or a paraphrase."""
+    key = _cache_key(_sql_prompt(user_question, conversation_history), SCHEMA_CONTEXT)
+    if _llm_caches["sql"].get(key) == sql:
+        del _llm_caches["sql"][key]
+    if SEMANTIC_CACHE_ENABLED:
+        _semantic_forget(sql)
+    _db_forget_sql(key, sql)
+
+
+def _summarize_rows(rows: list, max_rows: int = EXPLAIN_ROWS, max_cols: int = 12, max_chars: int = 2000) -> str:
+    """Serialize the first rows as compact JSON, keeping only non-null columns."""
+    pruned = []
+    for row in rows[:max_rows]:
+        if isinstance(row, dict):
+            row = dict([(k, v) for k, v in row.items() if v is not None][:max_cols])
+        pruned.append(row)
+
+    summary = json.dumps(pruned, separators=(",", ":"), default=str)
+    if len(summary) > max_chars:
+        summary = summary[:max_chars] + "...(truncated)"
+    return summary
+
+
+def _explain_input(results: dict) -> dict:
+    """Keep only what explain_results reads, so the explanation doesn't hold every fetched row."""
+    if "error" in results:
+        return {"error": results["error"]}
 
-async def explain_results(question: str, sql: str, results: dict) -> str:
-    """Use Claude CLI to explain query results in plain English."""
+    result_data = results.get("result", [])
+    total_rows = results.get("pagination", {}).get("total_count", len(result_data))
+    return {"result": result_data[:EXPLAIN_ROWS], "pagination": {"total_count": total_rows}}
+
+
+def _format_trivial_result(rows: list) -> str | None:
+    """Describe an empty or single-number result locally, or return None if Claude is needed."""
+    if not rows:
+        return "No rows matched this query."
+
+    if len(rows) == 1 and isinstance(rows[0], dict) and len(rows[0]) == 1:
+        column, value = next(iter(rows[0].items()))
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return f"The query returned **{value:,}** ({column})."
+
+    return None
+
+
+async def explain_results(question: str, sql: str, results: dict, on_text=None) -> str:
+    """Use Claude CLI to explain query results in plain English, streaming partial text to on_text."""
     if "error" in results:
         return f"**Query failed:** {results['error']}"
 
     result_data = results.get("result", [])
-    result_summary = str(result_data[:10])
+
+    # Counts and empty results don't need Claude to explain them
+    trivial = _format_trivial_result(result_data)
+    if trivial is not None:
+        return trivial
+
+    result_summary = _summarize_rows(result_data)
     total_rows = results.get("pagination", {}).get("total_count", len(result_data))
 
     prompt = f"""The user asked: "{question}"
 
 I ran this SQL: {sql}
 
-Results ({total_rows} rows total, showing first 10):
+Results ({total_rows} rows total, showing first {EXPLAIN_ROWS}):
 {result_summary}
 
 Explain what we found in 2-3 sentences. Be specific about numbers and findings."""
 
-    return await run.io_bound(_run_claude_cli, prompt)
+    return await _cached_claude("explain", prompt, on_text=on_text)
+
+
+async def prewarm_example(question: str):
+    """Generate and run SQL for one example question, caching it only if BERDL accepts it."""
+    sql = await generate_sql(question)
+    results = await query_berdl(sql)
+    if "error" in results:
+        forget_sql(question, [], sql)
+    else:
+        await remember_sql(question, [], sql)
+
+
+async def prewarm_examples():
+    """Prewarm the example questions concurrently so the buttons hit the cache."""
+    if SEMANTIC_CACHE_ENABLED:
+        await run.io_bound(_get_embedder)  # Load the model once before the concurrent calls
+    await asyncio.gather(*(prewarm_example(question) for question in EXAMPLE_QUESTIONS))
+
+
+# Set PREWARM_EXAMPLES=1 to fill the caches for the example buttons at startup
+if LLM_CACHE_ENABLED and _KB_TOKEN and os.getenv("PREWARM_EXAMPLES") == "1":
+    app.on_startup(lambda: background_tasks.create(prewarm_examples()))
 
 
 @ui.page('/')
 async def main_page():
     """Main page with chat interface."""
-    import json
-
     with ui.column().classes("w-full max-w-3xl mx-auto p-4"):
         with ui.row().classes("items-center gap-3 mb-2"):
             ui.icon("warehouse", size="32px").classes("text-blue-600")
@@ -239,10 +882,10 @@ async def main_page():
             status_text = ui.label("Checking connection...").classes("text-sm text-gray-500")
 
         async def check_connection():
-            result = await run.io_bound(query_berdl, "SELECT 1 as test")
-            if "error" in result:
+            ok, message = await check_berdl_health()
+            if not ok:
                 status_dot.classes("text-red-500", remove="text-yellow-500 text-green-500")
-                status_text.set_text(f"Disconnected: {result['error'][:50]}")
+                status_text.set_text(f"Disconnected: {message[:50]}")
             else:
                 status_dot.classes("text-green-500", remove="text-yellow-500 text-red-500")
                 status_text.set_text("Connected to BERDL")
@@ -262,11 +905,19 @@ async def main_page():
 
         async def send_message():
             question = input_field.value
-            if not question.strip():
+            if not question.strip() or not send_button.enabled:
                 return
 
             input_field.value = ""
 
+            # Ignore further submissions until this turn finishes
+            send_button.disable()
+            try:
+                await run_turn(question)
+            finally:
+                send_button.enable()
+
+        async def run_turn(question: str):
             # Add user message
             with chat_container:
                 with ui.card().classes("w-full"):
@@ -304,13 +955,15 @@ async def main_page():
                         ui.code(sql, language="sql")
 
                 status_label.set_text("Querying BERDL...")
-                results = await run.io_bound(query_berdl, sql)
+                results = await query_berdl(sql)
 
                 # Check if query succeeded
                 if "error" not in results:
+                    await remember_sql(question, conversation_history, sql)
                     break
 
                 # Query failed - prepare for retry
+                forget_sql(question, conversation_history, sql)
                 previous_sql = sql
                 error = results.get("error", "Unknown error")
 
@@ -319,6 +972,14 @@ async def main_page():
                 with response_container:
                     ui.label(f"Attempt {attempt + 1} failed: {error[:100]}...").classes("text-red-500 text-sm")
 
+            # Start the explanation right away so it overlaps with the UI updates below,
+            # streaming partial text into the markdown widget as it arrives
+            with explanation_container:
+                explanation_markdown = ui.markdown()
+            explanation_task = asyncio.create_task(
+                explain_results(question, sql, _explain_input(results), on_text=explanation_markdown.set_content)
+            )
+
             # Show final BERDL response
             response_container.clear()
             with response_container:
@@ -341,28 +1002,23 @@ async def main_page():
             })
 
             # Explain results
-            explanation = await explain_results(question, sql, results)
+            explanation = await explanation_task
 
             # Show final explanation
             spinner.delete()
             status_label.delete()
-            with explanation_container:
-                ui.markdown(explanation)
+            explanation_markdown.set_content(explanation)
 
         async def set_and_send(question: str):
+            if not send_button.enabled:
+                return
             input_field.value = question
             await send_message()
 
         # Example questions
         ui.label("Try these:").classes("text-sm text-gray-500 mt-2")
         with ui.row().classes("flex-wrap gap-2 mb-4"):
-            examples = [
-                "How many samples have plastic degradation?",
-                "What kingdoms are in the taxonomy?",
-                "Show samples with methanogenesis",
-                "Count studies by ecosystem type",
-            ]
-            for ex in examples:
+            for ex in EXAMPLE_QUESTIONS:
                 ui.button(ex, on_click=lambda e=ex: background_tasks.create(set_and_send(e))).props("flat dense").classes("text-xs")
 
         # Wire up input handlers
@@ -370,4 +1026,8 @@ async def main_page():
         send_button.on_click(lambda: background_tasks.create(send_message()))
 
 
+for name, value in [("KB_AUTH_TOKEN", _KB_TOKEN), ("ANTHROPIC_API_KEY", _ANTHROPIC_KEY)]:
+    if not value:
+        print(f"Warning: {name} is not set; add it to .env")
+
 ui.run(title="Lakehouse Chat", port=8081)